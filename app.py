@@ -1,12 +1,18 @@
 # --- imports ---
+import base64
+import io
+import logging
 import os
-import tempfile
-from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
 
 import streamlit as st
-import google.generativeai as gen_ai
-from streamlit_mic_recorder import mic_recorder
-from elevenlabs.client import ElevenLabs
+import streamlit.components.v1 as components
+# google.generativeai, elevenlabs, httpx, soundfile and scipy are imported inside the
+# factories/helpers that use them, so first paint doesn't wait on them
+
+from sentences import split_sentences
 
 # --- CONFIG ---
 st.set_page_config(
@@ -16,24 +22,53 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-load_dotenv(dotenv_path=".env")
+if not os.getenv("GOOGLE_API_KEY") or not os.getenv("ELEVEN_API_KEY"):
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=".env")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
 
+# --- LOGGING (configured once per process; reruns would otherwise stack handlers) ---
+@st.cache_resource
+def get_logger():
+    logger = logging.getLogger("agribuddy")
+    logger.addHandler(logging.NullHandler())
+    return logger
+
+logger = get_logger()
+
+# --- Languages (order is also the order of the Language selector) ---
+class Lang(IntEnum):
+    MALAYALAM = 0
+    ENGLISH = 1
+    HINDI = 2
+    SPANISH = 3
+
+    @property
+    def label(self):
+        return self.name.title()
+
+# ElevenLabs premade voice IDs (the TTS API takes IDs, not names)
+VOICE_ARIA = "9BWtsMINqrJLrRacOk9x"
+VOICE_BELLA = "EXAVITQu4vr4xnSDxMaL"
+
+# Language code + ElevenLabs voice ID, indexed by Lang
+LANG_TABLE = [("ml", VOICE_ARIA), ("en", VOICE_BELLA), ("hi", VOICE_ARIA), ("es", VOICE_ARIA)]
+
 # --- GLOBAL CSS (AgriBuddy Style) ---
-st.markdown("""
+# Colors live in .streamlit/config.toml [theme]; only what the theme can't express is injected here.
+CSS_BLOB = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&display=swap');
-    body, .stApp { font-family: 'Inter', sans-serif !important; background-color: #FCFCEF !important; }
-    h1, h2, h3, p, div { color: #2D2D2D !important; }
-    [data-testid="stSidebar"] { background-color: #ECF3EC !important; border-right: 1px solid #D6E4D6; }
-    [data-testid="stSidebar"] * { color: #2D2D2D !important; }
+    body, .stApp { font-family: 'Inter', sans-serif !important; }
+    [data-testid="stSidebar"] { border-right: 1px solid #D6E4D6; }
     .stChatMessage { border: 1px solid #E0E0E0; border-radius: 0.75rem !important; padding: 0.75rem; background-color: #f5f5f5 !important; margin-bottom: 0.5rem; color: #000 !important; }
     [data-testid="stChatInput"] textarea { background: #f5f5f5 !important; border: 1px solid #D6D6D6 !important; border-radius: 0.5rem !important; color: #000000 !important; }
     [data-testid="stChatInput"] textarea::placeholder { color: #555555 !important; }
     button, [data-testid="stSelectbox"] > div { border-radius: 0.5rem !important; border: 1px solid #D6D6D6 !important; }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CSS_BLOB, unsafe_allow_html=True)
 
 # --- API KEYS CHECK ---
 if not GOOGLE_API_KEY or not ELEVEN_API_KEY:
@@ -43,35 +78,230 @@ if not GOOGLE_API_KEY or not ELEVEN_API_KEY:
 # --- CACHE Gemini + ElevenLabs clients ---
 @st.cache_resource
 def get_gemini_client():
+    import google.generativeai as gen_ai
     gen_ai.configure(api_key=GOOGLE_API_KEY)
     return gen_ai
 
 @st.cache_resource
 def get_elevenlabs_client():
-    return ElevenLabs(api_key=ELEVEN_API_KEY)
+    import httpx
+    from elevenlabs.client import ElevenLabs
+    # One pooled keep-alive client so STT/TTS calls skip the TLS handshake after the first turn
+    httpx_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60),
+        timeout=60,
+    )
+    return ElevenLabs(api_key=ELEVEN_API_KEY, httpx_client=httpx_client)
 
-gen_ai_client = get_gemini_client()
-try:
-    eleven_client = get_elevenlabs_client()
-except Exception as e:
-    eleven_client = None
-    print(f"[WARN] ElevenLabs not available, fallback to text only. ({e})")
+# --- STT (mic bytes go straight to ElevenLabs, no temp file) ---
+STT_SAMPLE_RATE = 16000
+
+def compress_for_stt(audio_bytes):
+    """Re-encode mic WAV as 16 kHz mono Opus, a fraction of the raw upload size."""
+    import soundfile as sf
+    from scipy.signal import resample_poly
+    data, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32")
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sr != STT_SAMPLE_RATE:
+        data = resample_poly(data, STT_SAMPLE_RATE, sr)
+    buf = io.BytesIO()
+    sf.write(buf, data, STT_SAMPLE_RATE, format="OGG", subtype="OPUS")
+    buf.seek(0)
+    buf.name = "audio.ogg"
+    return buf
+
+# Mic button backed by in-browser Silero VAD: stops itself after trailing silence and
+# returns only the speech region as 16 kHz mono WAV
+_vad_recorder = components.declare_component(
+    "vad_recorder", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "vad_recorder")
+)
+
+def vad_recorder(start_prompt, stop_prompt, key):
+    value = _vad_recorder(start_prompt=start_prompt, stop_prompt=stop_prompt, key=key, default=None)
+    if not value:
+        return None
+    return {"bytes": base64.b64decode(value["audio"]), "id": value["id"]}
+
+def transcribe_audio_file(audio_bytes, lang_code):
+    try:
+        bio = compress_for_stt(audio_bytes)
+    except Exception:
+        logger.warning("Audio compression failed, uploading raw audio", exc_info=True)
+        bio = io.BytesIO(audio_bytes)
+        bio.name = "audio.wav"
+    transcript = eleven_client.speech_to_text.convert(
+        file=bio, model_id="scribe_v1", language_code=lang_code
+    )
+    return transcript.text
+
+# --- TTS pipeline (sentences are synthesized while Gemini is still streaming) ---
+@st.cache_resource
+def get_tts_pool():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+# Turbo v2.5 has far lower first-byte latency. Neither it nor multilingual v2 covers
+# Malayalam, so that language goes to Eleven v3, which does.
+TTS_MODEL = "eleven_turbo_v2_5"
+TTS_FALLBACK_MODELS = {"ml": "eleven_v3"}
+# ElevenLabs rejects language_code for any model outside the v2.5 Turbo/Flash family
+LANGUAGE_CODE_MODELS = {"eleven_turbo_v2_5", "eleven_flash_v2_5"}
+# Low-bitrate mp3: small enough to start playing almost at once, and segments concatenate cleanly
+TTS_OUTPUT_FORMAT = "mp3_22050_32"
+
+# Repeated phrases (greetings, confirmations) are served from memory instead of re-synthesized
+@st.cache_data(max_entries=256, ttl=3600, show_spinner=False)
+def _tts_cached(text, voice_id, model, lang):
+    audio = eleven_client.text_to_speech.stream(
+        voice_id=voice_id, text=text, model_id=model, language_code=lang, output_format=TTS_OUTPUT_FORMAT
+    )
+    return audio if isinstance(audio, bytes) else b"".join(audio)
+
+def tts_generate_bytes(text, voice_id, lang_code):
+    model = TTS_FALLBACK_MODELS.get(lang_code, TTS_MODEL)
+    return _tts_cached(text, voice_id, model, lang_code if model in LANGUAGE_CODE_MODELS else None)
 
 # --- SESSION STATE ---
+# History is a ring buffer: the oldest messages fall off so long sessions stay bounded
+MAX_HISTORY_MESSAGES = 200
 if "history" not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = deque(maxlen=MAX_HISTORY_MESSAGES)
 if "language" not in st.session_state:
-    st.session_state.language = "Malayalam"
+    st.session_state.language = Lang.MALAYALAM
 if "tts_enabled" not in st.session_state:
     st.session_state.tts_enabled = True
-if "chat" not in st.session_state:
-    model = gen_ai_client.GenerativeModel(
+
+# --- CHAT MODEL (one per language, chat session reused across turns) ---
+@st.cache_resource
+def get_model(lang):
+    return get_gemini_client().GenerativeModel(
         "gemini-1.5-flash",
-        system_instruction="You are a helpful assistant. Respond ONLY in Malayalam."
+        system_instruction=f"You are a helpful assistant. Respond ONLY in {lang.label}."
     )
-    st.session_state.chat = model.start_chat()
+
+def initialize_chat_model():
+    lang = st.session_state.language
+    st.session_state.chat = get_model(lang).start_chat()
+    st.session_state.model_language = lang
+    st.session_state.compacted_history_len = 0
+
+def recover_chat_model():
+    """Drop a blocked or half-streamed reply so the next turn starts from a coherent history."""
+    chat = st.session_state.get("chat")
+    if chat is None:
+        return
+    try:
+        chat.history  # raises once the last response is broken (SAFETY/RECITATION, dropped stream)
+    except Exception:
+        try:
+            chat.rewind()
+        except Exception:
+            initialize_chat_model()
+
+# The chat itself is started on the first turn (see handle_turn), not at session start
+
+# --- CONTEXT COMPACTION (older turns become a rolling summary, so TTFT stays bounded) ---
+SUMMARIZE_AFTER_TURNS = 10
+KEEP_RECENT_TURNS = 4
+
+@st.cache_resource
+def get_summary_model():
+    return get_gemini_client().GenerativeModel("gemini-1.5-flash")
+
+def compact_chat_history():
+    history = st.session_state.chat.history
+    # Count only turns added since the last compaction, not the summary + retained tail
+    if len(history) - st.session_state.compacted_history_len < 2 * SUMMARIZE_AFTER_TURNS:
+        return
+    cutoff = len(history) - 2 * KEEP_RECENT_TURNS
+    old, recent = history[:cutoff], history[cutoff:]
+    transcript = "\n".join(f"{c.role}: {''.join(p.text for p in c.parts)}" for c in old)
+    try:
+        summary = get_summary_model().generate_content("Summarize in ≤80 words:\n" + transcript).text
+    except Exception:
+        logger.warning("History summary failed, keeping full context", exc_info=True)
+        return
+    # Gemini expects alternating roles, so the summary gets a short model acknowledgement
+    st.session_state.chat = get_model(st.session_state.model_language).start_chat(history=[
+        {"role": "user", "parts": [f"Summary of our earlier conversation: {summary}"]},
+        {"role": "model", "parts": ["Understood."]},
+        *recent,
+    ])
+    st.session_state.compacted_history_len = len(st.session_state.chat.history)
+
+# --- TURN HANDLER ---
+# Gemini streams on the script thread (st.write_stream consumes it there) while completed
+# sentences are synthesized on the TTS pool, so the two stages overlap within a turn.
+def handle_turn(user_prompt, chat_container, selected_lang, lang_code, voice_id):
+    st.session_state.history.append({"role": "user", "text": user_prompt})
+    with chat_container.chat_message("user"):
+        st.write(user_prompt)
+
+    # Completed sentences are handed to the TTS pool as they stream in
+    tts_jobs = []
+    tts_pool = get_tts_pool() if st.session_state.tts_enabled and eleven_client else None
+
+    def speak(sentence):
+        if tts_pool and len(sentence) >= 2:
+            tts_jobs.append(tts_pool.submit(tts_generate_bytes, sentence, voice_id, lang_code))
+
+    def token_gen():
+        buffer = ""
+        for chunk in st.session_state.chat.send_message(user_prompt, stream=True):
+            if chunk.text:
+                buffer += chunk.text
+                sentences, buffer = split_sentences(buffer)
+                for sentence in sentences:
+                    speak(sentence)
+                yield chunk.text
+        if buffer.strip():
+            speak(buffer.strip())
+
+    # Gemini reply
+    failed = False
+    with chat_container.chat_message("assistant"):
+        try:
+            if st.session_state.get("model_language") != selected_lang:
+                initialize_chat_model()
+            compact_chat_history()
+            bot_text = st.write_stream(token_gen())
+        except Exception as e:
+            failed = True
+            recover_chat_model()
+            bot_text = f"⚠️ Gemini error: {e}"
+            st.write(bot_text)
+            for job in tts_jobs:
+                job.cancel()
+            tts_jobs.clear()
+
+    st.session_state.history.append({"role": "assistant", "text": bot_text})
+
+    # --- TTS reply (mp3 segments concatenate into one playable stream) ---
+    # Never speak error text: a failed turn's queued sentences are cancelled above
+    if tts_jobs and not failed:
+        segments = []
+        for job in tts_jobs:
+            try:
+                segments.append(job.result())
+            except Exception:
+                logger.exception("TTS failed for one sentence, skipping it")
+        if segments:
+            st.audio(b"".join(segments), format="audio/mp3", autoplay=True)
 
 # --- SIDEBAR ---
+# Settings run as a fragment: toggling TTS or switching language reruns only this panel,
+# not the chat history below. The new values are read on the next full run.
+@st.fragment
+def settings_panel():
+    st.session_state.tts_enabled = st.toggle("Enable TTS", value=st.session_state.tts_enabled)
+    st.session_state.language = st.selectbox(
+        "Language", list(Lang), index=0, format_func=lambda lang: lang.label
+    )
+    if st.button("Clear Chat History"):
+        st.session_state.history.clear()
+        st.rerun()
+
 with st.sidebar:
     st.image("https://upload.wikimedia.org/wikipedia/commons/6/6e/Agriculture_icon.png", width=100)
     st.markdown("## AgriBuddy 🌱")
@@ -79,11 +309,7 @@ with st.sidebar:
     st.markdown("---")
 
     with st.expander("⚙️ Settings", expanded=True):
-        st.session_state.tts_enabled = st.toggle("Enable TTS", value=st.session_state.tts_enabled)
-        st.session_state.language = st.selectbox("Language", ["Malayalam", "English", "Hindi", "Spanish"], index=0)
-        if st.button("Clear Chat History"):
-            st.session_state.history = []
-            st.rerun()
+        settings_panel()
 
     with st.expander("💡 Tips", expanded=False):
         st.markdown("""
@@ -103,6 +329,17 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# --- ElevenLabs client (after the header, so its import doesn't delay first paint) ---
+try:
+    eleven_client = get_elevenlabs_client()
+except Exception:
+    eleven_client = None
+    logger.warning("ElevenLabs not available, fallback to text only", exc_info=True)
+
+# --- Active language (a single table index per run) ---
+selected_lang = st.session_state.language
+lang_code, voice_id = LANG_TABLE[selected_lang]
+
 # --- Navigation Tabs ---
 tab_choice = st.radio("Navigation", ["New Chat", "Chat History"], horizontal=True, label_visibility="collapsed")
 
@@ -118,71 +355,20 @@ if tab_choice == "New Chat":
             st.write(msg["text"])
 
     # --- Mic Input ---
-    mic_audio = mic_recorder(start_prompt="🎤 Speak", stop_prompt="⏹️ Stop", key="mic")
+    mic_audio = vad_recorder(start_prompt="🎤 Speak", stop_prompt="✖️ Cancel", key="mic")
     user_prompt = st.chat_input("Type your message...")
 
-    # Language → code + voice mapping
-    lang_voice_map = {
-        "Malayalam": {"code": "ml", "voice": "Aria"},
-        "Hindi": {"code": "hi", "voice": "Aria"},
-        "English": {"code": "en", "voice": "Bella"},
-        "Spanish": {"code": "es", "voice": "Sofia"}
-    }
-    selected_lang = st.session_state.language
-    lang_config = lang_voice_map.get(selected_lang, {"code": "en", "voice": "Bella"})
-    lang_code, voice_name = lang_config["code"], lang_config["voice"]
-
-    # If user speaks instead of typing
-    if mic_audio and "bytes" in mic_audio and eleven_client:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(mic_audio["bytes"])
-            audio_path = tmp_file.name
+    # If user speaks instead of typing (the component keeps returning its last
+    # recording, so only transcribe new ones)
+    if mic_audio and mic_audio["id"] != st.session_state.get("last_audio_id") and eleven_client:
+        st.session_state.last_audio_id = mic_audio["id"]
         try:
-            transcript = eleven_client.speech_to_text.convert(
-                file=audio_path, model="eleven_multilingual_v2", language_code=lang_code
-            )
-            user_prompt = transcript.text
-        except Exception as e:
-            print(f"[ERROR] STT failed, fallback to text input. ({e})")
+            user_prompt = transcribe_audio_file(mic_audio["bytes"], lang_code)
+        except Exception:
+            logger.exception("STT failed, fallback to text input")
 
     if user_prompt:
-        st.session_state.history.append({"role": "user", "text": user_prompt})
-        with chat_container.chat_message("user"):
-            st.write(user_prompt)
-
-        # Gemini reply
-        with chat_container.chat_message("assistant"):
-            placeholder = st.empty()
-            bot_text = ""
-            try:
-                model = gen_ai_client.GenerativeModel(
-                    "gemini-1.5-flash",
-                    system_instruction=f"You are a helpful assistant. Respond ONLY in {selected_lang}."
-                )
-                st.session_state.chat = model.start_chat()
-                for chunk in st.session_state.chat.send_message(user_prompt, stream=True):
-                    if chunk.text:
-                        bot_text += chunk.text
-                        placeholder.markdown(bot_text + "▌")
-                placeholder.markdown(bot_text)
-            except Exception as e:
-                bot_text = f"⚠️ Gemini error: {e}"
-                placeholder.write(bot_text)
-
-        st.session_state.history.append({"role": "assistant", "text": bot_text})
-
-        # --- TTS reply ---
-        if st.session_state.tts_enabled and bot_text and eleven_client:
-            try:
-                audio = eleven_client.text_to_speech.convert(
-                    voice=voice_name, text=bot_text, model="eleven_multilingual_v2", language_code=lang_code
-                )
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                    tmp_file.write(audio)
-                    audio_path = tmp_file.name
-                st.audio(audio_path, format="audio/mp3")
-            except Exception as e:
-                print(f"[ERROR] TTS failed, showing text only. ({e})")
+        handle_turn(user_prompt, chat_container, selected_lang, lang_code, voice_id)
 
 elif tab_choice == "Chat History":
     st.subheader("📜 Previous Conversations")
@@ -0,0 +1,20 @@
+# --- Sentence splitting for the streaming TTS pipeline (stdlib only, no Streamlit) ---
+import re
+
+# A sentence ends on a terminator followed by whitespace (so "3." waits for the next token),
+# unless the terminator closes a common abbreviation like "Dr." or "e.g."
+SENTENCE_END_RE = re.compile(
+    r"(?<!\bDr)(?<!\bMr)(?<!\bMrs)(?<!\bMs)(?<!\bSt)(?<!\bvs)(?<!\betc)(?<!\be\.g)(?<!\bi\.e)"
+    r"[.!?।]+(?=\s)"
+)
+MIN_SENTENCE_CHARS = 10
+
+def split_sentences(buffer):
+    """Pull complete sentences off the front of buffer, returning (sentences, remainder)."""
+    sentences, start = [], 0
+    for match in SENTENCE_END_RE.finditer(buffer):
+        sentence = buffer[start:match.end()].strip()
+        if len(sentence) >= MIN_SENTENCE_CHARS:  # short ones ("Yes.") ride along with the next
+            sentences.append(sentence)
+            start = match.end()
+    return sentences, buffer[start:]
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sentences import split_sentences
+
+
+def stream(text, size=3):
+    """Feed text through split_sentences a few characters at a time, like streamed tokens."""
+    spoken, buffer = [], ""
+    for i in range(0, len(text), size):
+        buffer += text[i:i + size]
+        sentences, buffer = split_sentences(buffer)
+        spoken.extend(sentences)
+    return spoken, buffer
+
+
+class SplitSentencesTest(unittest.TestCase):
+    def test_unfinished_sentence_after_abbreviation_is_held(self):
+        self.assertEqual(split_sentences("Please consult Dr. Smith about"), ([], "Please consult Dr. Smith about"))
+
+    def test_abbreviations_do_not_end_sentences_while_streaming(self):
+        spoken, rest = stream("Please consult Dr. Smith about the soil. Mr. Rao agrees. Done")
+        self.assertEqual(spoken, ["Please consult Dr. Smith about the soil.", "Mr. Rao agrees."])
+        self.assertEqual(rest.strip(), "Done")
+
+    def test_inline_periods_do_not_stall_splitting(self):
+        spoken, rest = stream("Apply urea e.g. twice a month. Use 2.5 kg i.e. Rs.500 worth. Next")
+        self.assertEqual(spoken, ["Apply urea e.g. twice a month.", "Use 2.5 kg i.e. Rs.500 worth."])
+        self.assertEqual(rest.strip(), "Next")
+
+    def test_short_sentences_merge_into_the_next(self):
+        self.assertEqual(split_sentences("Yes. Sow in June. "), (["Yes. Sow in June."], " "))
+
+    def test_hindi_danda_ends_sentences(self):
+        self.assertEqual(split_sentences("यह बहुत अच्छा है। और"), (["यह बहुत अच्छा है।"], " और"))
+
+
+if __name__ == "__main__":
+    unittest.main()